@@ -3,10 +3,19 @@ Arab Dubbing API V22 - Cloud Native Architecture
 Split-Process-Stream Pipeline with GCS Storage
 """
 import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, UploadFile, File, Form, BackgroundTasks, Request, HTTPException
-from fastapi.responses import StreamingResponse, RedirectResponse, FileResponse
+from fastapi.responses import Response, JSONResponse, StreamingResponse, RedirectResponse, FileResponse
 import uuid
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,6 +25,7 @@ from services.jobs import job_manager
 from services.db import db_service
 from services.storage import gcs_service
 from services.processing import process_segment_pipeline
+from services.events import job_events
 
 app = FastAPI(title="Arab Dubbing API V22", version="22.0.0")
 
@@ -25,6 +35,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 # ... (Existing health/root endpoints) ...
@@ -45,15 +56,19 @@ def health():
 
 @app.on_event("startup")
 async def startup_event():
-    """Force CORS config on startup to prevent permission resets."""
+    """Ensure bucket CORS + lifecycle config on startup (GCS_CONFIGURE_CORS=1 forces a re-apply after permission resets)."""
     print("🔄 Ensuring GCS CORS Policy is Public...")
-    gcs_service.configure_cors()
+    force = os.getenv("GCS_CONFIGURE_CORS") == "1"
+    await run_in_threadpool(gcs_service.configure_cors, force=force)
+    await run_in_threadpool(gcs_service.configure_lifecycle, force=force)
 
 @app.get("/")
 def root():
     return {"message": "Arab Dubbing API V22 - Ready"}
 
 
+UPLOAD_COPY_CHUNK = 1024 * 1024
+
 # NEW: Upload endpoint for chunked processing
 @app.post("/upload")
 async def upload_video(
@@ -66,25 +81,26 @@ async def upload_video(
     os.makedirs(job_manager.upload_dir, exist_ok=True)
     temp_path = os.path.join(job_manager.upload_dir, file.filename)
     with open(temp_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
+        # Copy the spooled upload in 1MB chunks instead of reading it all into memory
+        await run_in_threadpool(shutil.copyfileobj, file.file, f, UPLOAD_COPY_CHUNK)
     
-    # 2. Create Job & Split
-    job_id, segments, thumb_path = job_manager.create_job(temp_path, file.filename, mode, target_lang)
+    # 2. Create Job (blocking ffmpeg + DB calls: keep them off the event loop).
+    # Splitting happens in the background so the client can start watching immediately.
+    job_id, thumb_path = await run_in_threadpool(job_manager.create_job, temp_path, file.filename, mode, target_lang)
     
     # 2.5 Upload Thumbnail to GCS
     thumb_url = None
     if thumb_path and os.path.exists(thumb_path):
         thumb_name = f"jobs/{job_id}/thumbnail.jpg"
-        thumb_url = gcs_service.upload_file(thumb_path, thumb_name, content_type="image/jpeg")
+        thumb_url = await run_in_threadpool(gcs_service.upload_file, thumb_path, thumb_name, content_type="image/jpeg")
         # Cleanup thumb
         try: os.remove(thumb_path)
-        except: pass
+        except OSError: pass
 
     # 3. Queue Background Processing
-    background_tasks.add_task(process_job_sequentially, job_id, segments, temp_path)
+    background_tasks.add_task(process_job_sequentially, job_id, temp_path)
     
-    return {"status": "ok", "job_id": job_id, "task_id": job_id, "segments_count": len(segments), "thumbnail_url": thumb_url}
+    return {"status": "ok", "job_id": job_id, "task_id": job_id, "thumbnail_url": thumb_url}
 
 # LEGACY: Keep old endpoint for backward compatibility
 @app.post("/process-video")
@@ -115,6 +131,202 @@ async def stream_video(job_id: str, filename: str):
 
     return {"error": "File not found (GCS & Local)"}, 404
 
+# Read-through cache for job rows: many tabs/streams watching one job share a
+# single DB read per second. Entries are dropped as soon as the worker writes.
+JOB_CACHE_TTL = 1.0
+JOB_CACHE_MAX_ENTRIES = 10000
+_job_cache = {} # (job_id, kind) -> (expires_at, rows)
+_job_generations = {} # job_id -> write counter, bumped by _job_changed
+_job_cache_lock = threading.Lock()
+
+def _read_job(job_id: str, kind: str = "segments") -> list:
+    """Cached db_service.get_job_segments / get_job_statuses. Callers must not mutate rows."""
+    key, now = (job_id, kind), time.monotonic()
+    with _job_cache_lock:
+        hit = _job_cache.get(key)
+        generation = _job_generations.get(job_id, 0)
+    if hit and hit[0] > now:
+        return hit[1]
+    rows = db_service.get_job_statuses(job_id) if kind == "statuses" else db_service.get_job_segments(job_id)
+    with _job_cache_lock:
+        if _job_generations.get(job_id, 0) != generation:
+            return rows # A write landed mid-query: these rows may be stale, don't cache them
+        if len(_job_cache) >= JOB_CACHE_MAX_ENTRIES:
+            for k in [k for k, (exp, _) in _job_cache.items() if exp <= now]:
+                del _job_cache[k]
+        _job_cache[key] = (now + JOB_CACHE_TTL, rows)
+    return rows
+
+def _job_changed(job_id: str):
+    """Invalidate cached reads for the job and wake its listeners."""
+    with _job_cache_lock:
+        _job_generations[job_id] = _job_generations.get(job_id, 0) + 1
+        _job_cache.pop((job_id, "segments"), None)
+        _job_cache.pop((job_id, "statuses"), None)
+    job_events.publish(job_id)
+
+def _job_cache_forget(job_id: str):
+    """Drop a finished job's cache bookkeeping (the generation counter would otherwise leak)."""
+    with _job_cache_lock:
+        _job_generations.pop(job_id, None)
+        _job_cache.pop((job_id, "segments"), None)
+        _job_cache.pop((job_id, "statuses"), None)
+
+def _segment_filename(job_id: str, idx: int) -> str:
+    return f"{job_id}_seg{idx}_dubbed.mp4"
+
+def _final_filename(job_id: str) -> str:
+    return f"{job_id}_final.mp4"
+
+FINAL_FETCH_WORKERS = 8
+# Final-video builds in flight, and jobs whose last build failed (reported once, then retried)
+_final_building = set()
+_final_failed = set()
+_final_guard = threading.Lock()
+
+def _final_ready(job_id: str) -> bool:
+    final_name = _final_filename(job_id)
+    return os.path.exists(os.path.join("output", final_name)) or gcs_service.blob_exists(f"jobs/{job_id}/{final_name}")
+
+def _build_final_video(job_id: str, count: int) -> bool:
+    """
+    Stitch all dubbed segments into one MP4 (stream-copy concat) and store it like a segment:
+    GCS at jobs/{job_id}/{job_id}_final.mp4, or output/ when GCS is unavailable.
+    Segments are taken from output/ when still on disk, otherwise downloaded from GCS.
+    """
+    final_name = _final_filename(job_id)
+    final_path = os.path.join("output", final_name)
+    work_dir = tempfile.mkdtemp(prefix=f"final_{job_id}_")
+    try:
+        paths, missing = [], []
+        for idx in range(count):
+            name = _segment_filename(job_id, idx)
+            local = os.path.join("output", name)
+            if not os.path.exists(local):
+                local = os.path.join(work_dir, name)
+                missing.append((f"jobs/{job_id}/{name}", local))
+            paths.append(local)
+
+        # Fetch segments that are only in GCS concurrently (~1 RTT instead of N)
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(FINAL_FETCH_WORKERS, len(missing))) as pool:
+                if not all(pool.map(lambda m: gcs_service.download_file(*m), missing)):
+                    return False
+
+        os.makedirs("output", exist_ok=True)
+        job_manager.concat_segments(paths, final_path)
+        if gcs_service.upload_file(final_path, f"jobs/{job_id}/{final_name}"):
+            os.remove(final_path)
+        print(f"🎞️ Final video built for Job {job_id} ({count} segments)")
+        return True
+    except Exception as e:
+        print(f"❌ Final Video Build Failed: {e}")
+        if os.path.exists(final_path):
+            os.remove(final_path) # Don't let a partial file pass for a finished build
+        return False
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _final_build_thread(job_id: str, count: int):
+    ok = _build_final_video(job_id, count)
+    with _final_guard:
+        _final_building.discard(job_id)
+        if not ok:
+            _final_failed.add(job_id)
+
+def _final_status(job_id: str, count: int) -> str:
+    """
+    "ready", "building" or "failed" for a complete multi-segment job.
+    Starts a background build on first ask, so requests never wait on ffmpeg.
+    """
+    with _final_guard:
+        if job_id in _final_building:
+            return "building"
+        if job_id in _final_failed:
+            _final_failed.discard(job_id) # Report once; the next ask retries
+            return "failed"
+    if _final_ready(job_id):
+        return "ready"
+    with _final_guard:
+        if job_id in _final_failed: # Build ended between the two checks
+            _final_failed.discard(job_id)
+            return "failed"
+        if job_id not in _final_building:
+            _final_building.add(job_id)
+            threading.Thread(target=_final_build_thread, args=(job_id, count), daemon=True).start()
+    return "building"
+
+def _final_pending(job_id: str, count: int):
+    """None once the final video exists, else the response to send while it is built."""
+    status = _final_status(job_id, count)
+    if status == "failed":
+        raise HTTPException(status_code=500, detail="Could not build the final video")
+    if status == "building":
+        return JSONResponse(status_code=202, content={"status": "building"}, headers={"Retry-After": "5"})
+    return None
+
+def _complete_job_statuses(job_id: str) -> list:
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Job ID format")
+
+    segments = _read_job(job_id, "statuses")
+    if not segments or any(s.get("status") != "ready" for s in segments):
+        raise HTTPException(status_code=409, detail="Job is not complete")
+    return segments
+
+@app.post("/job/{job_id}/final")
+def prepare_final_video(job_id: str):
+    """
+    Ask for the whole dubbed video as one file. Built on demand in the background:
+    202 {"status": "building"} until it exists, then 200 {"status": "ready", "url"}.
+    """
+    segments = _complete_job_statuses(job_id)
+    if len(segments) > 1:
+        pending = _final_pending(job_id, len(segments))
+        if pending: return pending
+    return {"status": "ready", "url": f"/job/{job_id}/final.mp4"}
+
+@app.get("/job/{job_id}/final.mp4")
+def get_final_video(job_id: str):
+    """The whole dubbed video as one file (202 while POST /job/{id}/final's build runs)."""
+    segments = _complete_job_statuses(job_id)
+    if len(segments) == 1:
+        return RedirectResponse(url=f"/stream/{job_id}/{_segment_filename(job_id, 0)}")
+    pending = _final_pending(job_id, len(segments))
+    if pending: return pending
+    return RedirectResponse(url=f"/stream/{job_id}/{_final_filename(job_id)}")
+
+def _job_segments(job_id: str, base_url: str) -> list:
+    """Fetch a job's segments and rewrite ready media URLs to the proxy stream."""
+    segments = [dict(seg) for seg in _read_job(job_id)] # Copy: URLs are rewritten below
+    for seg in segments:
+        if seg.get("status") == "ready" and seg.get("media_url"):
+            filename = _segment_filename(job_id, seg["segment_index"])
+            seg["media_url"] = f"{base_url}/stream/{job_id}/{filename}"
+    return segments
+
+def _segment_counts(segments: list) -> dict:
+    """Ready/failed/total in a single pass over segments."""
+    counts = Counter(s.get("status", "pending") for s in segments)
+    return {"ready": counts["ready"], "failed": counts["failed"], "total": len(segments)}
+
+def _job_payload(job_id: str, base_url: str, view: str) -> tuple:
+    """
+    Payload for the push/long-poll endpoints plus whether the job is settled.
+    view="summary" sends only counts (tens of bytes) instead of the segment list.
+    """
+    if view == "summary":
+        counts = _segment_counts(_read_job(job_id, "statuses"))
+        payload = {"job_id": job_id, **counts}
+    else:
+        segments = _job_segments(job_id, base_url)
+        counts = _segment_counts(segments)
+        payload = {"job_id": job_id, "segments": segments}
+    settled = counts["total"] > 0 and counts["ready"] + counts["failed"] == counts["total"]
+    return payload, settled
+
 @app.get("/job/{job_id}")
 def get_job_status(job_id: str, request: Request):
     """Retrieve segments from DB and rewrite URLs to use Proxy Stream."""
@@ -124,19 +336,92 @@ def get_job_status(job_id: str, request: Request):
         # Prevent DB error if ID is 'undefined' or invalid
         return {"error": "Invalid Job ID format"}, 400
 
-    segments = db_service.get_job_segments(job_id)
-    
-    # Rewrite media_url to use our Proxy Stream
     base_url = str(request.base_url).rstrip("/")
-    for seg in segments:
-        if seg.get("status") == "ready" and seg.get("media_url"):
-            # Extract filename from the Signed URL or DB entry?
-            # The 'media_url' in DB is likely the Signed URL or GCS path.
-            # But we know the naming convention: "{job_id}_seg{idx}_dubbed.mp4"
-            filename = f"{job_id}_seg{seg['segment_index']}_dubbed.mp4"
-            seg["media_url"] = f"{base_url}/stream/{job_id}/{filename}"
-            
-    return {"job_id": job_id, "segments": segments}
+    payload = {"job_id": job_id, "segments": _job_segments(job_id, base_url)}
+
+    # Conditional GET: pollers send back the ETag and get an empty 304 while nothing changed
+    body = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    etag = f'"{hashlib.sha1(body.encode("utf-8")).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Long-poll requests are held at most this long before returning unchanged state
+LONG_POLL_MAX_SECONDS = 30
+
+@app.get("/job/{job_id}/wait")
+async def wait_job_status(job_id: str, request: Request, since: int = -1, timeout: float = 25, view: str = "full"):
+    """Long poll: hold the request until the job's version moves past `since` (or timeout)."""
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Job ID format")
+
+    timeout = max(0.0, min(timeout, LONG_POLL_MAX_SECONDS))
+    version = await job_events.wait(job_id, since, timeout)
+    base_url = str(request.base_url).rstrip("/")
+    payload, _ = await run_in_threadpool(_job_payload, job_id, base_url, view)
+    return {**payload, "version": version}
+
+@app.get("/job/{job_id}/summary")
+def get_job_summary(job_id: str):
+    """Counts only: {ready, failed, total, version}. Fetch /job/{id} for media URLs."""
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Job ID format")
+
+    counts = _segment_counts(_read_job(job_id, "statuses"))
+    return {"job_id": job_id, **counts, "version": job_events.version(job_id)}
+
+SSE_KEEPALIVE_SECONDS = 15  # Comment ping so proxies don't drop an idle stream
+
+@app.get("/job/{job_id}/stream")
+async def stream_job_status(job_id: str, request: Request, view: str = "full"):
+    """Server-Sent Events: push the /job payload (or counts, view=summary) whenever a segment changes state."""
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Job ID format")
+
+    base_url = str(request.base_url).rstrip("/")
+
+    async def event_stream():
+        version, last_payload = -1, None
+        while not await request.is_disconnected():
+            new_version = await job_events.wait(job_id, version, SSE_KEEPALIVE_SECONDS)
+            changed = new_version != version
+            version = new_version
+            # On a quiet timeout re-read anyway: the job may be owned by another process
+            data, settled = await run_in_threadpool(_job_payload, job_id, base_url, view)
+            payload = json.dumps(data, ensure_ascii=False)
+            if payload != last_payload:
+                last_payload = payload
+                yield f"data: {payload}\n\n"
+            elif not changed:
+                yield ": ping\n\n"
+            if settled:
+                yield "event: done\ndata: {}\n\n"
+                break
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/job/{job_id}/cancel")
+def cancel_job(job_id: str):
+    """Stop a running job after its current segment; remaining segments are marked failed."""
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Job ID format")
+
+    if not job_manager.cancel(job_id):
+        raise HTTPException(status_code=404, detail="Job is not running")
+    return {"status": "cancelling", "job_id": job_id}
 
 # LEGACY: Keep old status endpoint for backward compatibility
 @app.get("/status/{task_id}")
@@ -147,19 +432,20 @@ def get_task_status_legacy(task_id: str):
     except ValueError:
         return {"error": "Invalid Job ID format"}, 400
 
-    segments = db_service.get_job_segments(task_id)
+    segments = _read_job(task_id)
     
     # Determine overall progress
     if not segments:
         return {"status": "PENDING", "progress": 0, "message": "جاري التجهيز..."}
     
-    ready_count = sum(1 for s in segments if s.get("status") == "ready")
-    total = len(segments)
+    counts = _segment_counts(segments)
+    ready_count = counts["ready"]
+    total = counts["total"]
     progress = int((ready_count / total) * 100) if total > 0 else 0
     
     # Status
-    all_ready = all(s.get("status") == "ready" for s in segments)
-    any_failed = any(s.get("status") == "failed" for s in segments)
+    all_ready = ready_count == total
+    any_failed = counts["failed"] > 0
     
     if all_ready:
         status = "COMPLETED"
@@ -178,25 +464,59 @@ def get_task_status_legacy(task_id: str):
         return {"status": "PROCESSING", "progress": progress, "message": f"معالجة الجزء {ready_count+1}/{total}..."}
 
 # --- BACKGROUND WORKER ---
-def process_job_sequentially(job_id: str, segments: list, source_path: str):
-    """Process each segment sequentially with immediate cleanup."""
+def _set_segment_status(job_id: str, idx: int, status: str, **kwargs):
+    """Write segment status to DB and wake any streaming listeners."""
+    db_service.update_segment_status(job_id, idx, status, **kwargs)
+    _job_changed(job_id)
+
+def process_job_sequentially(job_id: str, source_path: str):
+    """Split the upload, then process each segment sequentially with immediate cleanup."""
+    try:
+        segments = job_manager.split_job(job_id, source_path)
+    except Exception as e:
+        print(f"❌ Split Failed for Job {job_id}: {e}")
+        segments = []
+    if not segments:
+        # Nothing to process: surface a failed segment so watchers settle
+        db_service.create_segment(job_id, 0, status="failed")
+        _job_changed(job_id)
+        job_manager.cleanup_source(source_path)
+        job_manager.finish(job_id)
+        return
+    _job_changed(job_id) # Segments registered: total is known now
+
     print(f"🚀 Starting Job {job_id} ({len(segments)} segments)")
     
     for idx, seg_path in enumerate(segments):
+        if job_manager.is_cancelled(job_id):
+            print(f"🛑 Job {job_id} cancelled before segment {idx}")
+            for rest_idx, rest_path in enumerate(segments[idx:], start=idx):
+                _set_segment_status(job_id, rest_idx, "failed")
+                job_manager.cleanup_segment(rest_path)
+            break
         try:
             print(f"⚡ Processing Segment {idx+1}/{len(segments)}: {seg_path}")
             
             # Update Status: Processing
             print(f"DEBUG: Updating DB for Job ID: {job_id}, Segment: {idx}")
-            db_service.update_segment_status(job_id, idx, "processing")
+            _set_segment_status(job_id, idx, "processing")
             
             # OUTPUT PATH
-            output_name = f"{job_id}_seg{idx}_dubbed.mp4"
+            output_name = _segment_filename(job_id, idx)
             output_path = os.path.join("output", output_name)
             os.makedirs("output", exist_ok=True)
             
             # CORE PIPELINE (Dub the chunk)
-            process_segment_pipeline(seg_path, output_path)
+            process_segment_pipeline(seg_path, output_path, should_stop=lambda: job_manager.is_cancelled(job_id))
+            if job_manager.is_cancelled(job_id):
+                # Stopped mid-segment: don't upload or publish a partial result.
+                # The next loop iteration fails the remaining segments.
+                print(f"🛑 Job {job_id} cancelled during segment {idx}")
+                _set_segment_status(job_id, idx, "failed")
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                job_manager.cleanup_segment(seg_path)
+                continue
             
             # UPLOAD TO GCS
             gcs_url = None
@@ -206,7 +526,7 @@ def process_job_sequentially(job_id: str, segments: list, source_path: str):
             # Update Status: Ready
             if gcs_url:
                 status = "ready"
-                db_service.update_segment_status(job_id, idx, status, media_url=gcs_url)
+                _set_segment_status(job_id, idx, status, media_url=gcs_url)
                 # Cleanup local if GCS success
                 if os.path.exists(output_path):
                     os.remove(output_path)
@@ -215,7 +535,7 @@ def process_job_sequentially(job_id: str, segments: list, source_path: str):
                 print(f"⚠️ GCS Upload Failed. Keeping {output_name} locally.")
                 # Construct local proxy URL
                 local_url = f"/stream/{job_id}/{output_name}"
-                db_service.update_segment_status(job_id, idx, "ready", media_url=local_url)
+                _set_segment_status(job_id, idx, "ready", media_url=local_url)
                 # DO NOT DELETE output_path! Keep it for serving.
 
             # Cleanup Source Chunk always
@@ -223,10 +543,13 @@ def process_job_sequentially(job_id: str, segments: list, source_path: str):
             
         except Exception as e:
             print(f"❌ Segment {idx} Failed: {e}")
-            db_service.update_segment_status(job_id, idx, "failed")
+            _set_segment_status(job_id, idx, "failed")
     
     # Final Cleanup
     job_manager.cleanup_source(source_path)
+    job_manager.finish(job_id)
+    job_events.forget(job_id)
+    _job_cache_forget(job_id)
     print(f"🏁 Job {job_id} Completed!")
 
 if __name__ == "__main__":
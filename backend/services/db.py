@@ -87,5 +87,18 @@ class DatabaseService:
                 time.sleep(1) # Wait 1s and retry
         return []
 
+    def get_job_statuses(self, job_id: str):
+        """Lightweight variant of get_job_segments: only index + status per segment."""
+        self._ensure_connection()
+        if not self.client: return []
+        for attempt in range(3):
+            try:
+                res = self.client.table("video_segments").select("segment_index,status").eq("job_id", job_id).order("segment_index").execute()
+                return res.data
+            except Exception as e:
+                print(f"⚠️ DB Status Fetch Error (Attempt {attempt+1}): {e}")
+                time.sleep(1)
+        return []
+
 db_service = DatabaseService()
 
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+
+
+class JobEventBus:
+    """
+    In-process change notifications for job segments.
+    The background worker publishes after every DB status write; streaming
+    endpoints await the next change instead of re-querying the DB on a timer.
+    Single-process only (one uvicorn worker), which is how the API is deployed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}  # job_id -> change counter
+        self._waiters = {}   # job_id -> set of (loop, asyncio.Event)
+
+    def version(self, job_id: str) -> int:
+        with self._lock:
+            return self._versions.get(job_id, 0)
+
+    def publish(self, job_id: str):
+        """Bump the job's version and wake every waiter (safe from worker threads)."""
+        with self._lock:
+            self._versions[job_id] = self._versions.get(job_id, 0) + 1
+            waiters = list(self._waiters.get(job_id, ()))
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # Loop already closed (client went away)
+
+    async def wait(self, job_id: str, since: int, timeout: float) -> int:
+        """Return the job's version once it differs from `since`, or after `timeout` seconds."""
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._lock:
+            current = self._versions.get(job_id, 0)
+            if current != since:
+                return current
+            self._waiters.setdefault(job_id, set()).add(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(job_id)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[job_id]
+        return self.version(job_id)
+
+    def forget(self, job_id: str):
+        """Drop the counter once a job is finished and nobody is listening."""
+        with self._lock:
+            if not self._waiters.get(job_id):
+                self._versions.pop(job_id, None)
+
+
+job_events = JobEventBus()
@@ -1,7 +1,9 @@
 import os
+import json
 import uuid
 import subprocess
 import glob
+import threading
 from services.db import db_service
 
 class JobManager:
@@ -10,18 +12,37 @@ class JobManager:
         self.temp_dir = temp_dir
         os.makedirs(upload_dir, exist_ok=True)
         os.makedirs(temp_dir, exist_ok=True)
+        # Jobs still being processed, and the subset the user asked to stop
+        self._lock = threading.Lock()
+        self._active = set()
+        self._cancelled = set()
 
-    def create_job(self, file_path: str, original_filename: str, mode: str, target_lang: str) -> str:
+    def create_job(self, file_path: str, original_filename: str, mode: str, target_lang: str):
         """
-        Creates a job, splits the video, and registers segments in DB.
-        Returns job_id.
+        Registers the job in DB and grabs a thumbnail (fast path, runs in the request).
+        Splitting is deferred to split_job so the client gets its job_id right away.
+        Returns (job_id, thumbnail_path or None).
         """
         job_id = str(uuid.uuid4())
+        with self._lock:
+            self._active.add(job_id)
         
         # 1. Register Job in DB
         db_service.create_job(job_id, original_filename, mode, target_lang)
         
-        # 2. Split Video into 5-minute chunks
+        # 2. Generate Thumbnail (seek before -i: decodes a single frame)
+        thumbnail_path = os.path.join(self.upload_dir, f"{job_id}_thumb.jpg")
+        thumb_cmd = ["ffmpeg", "-ss", "00:00:01", "-i", file_path, "-vframes", "1", "-y", thumbnail_path]
+        subprocess.run(thumb_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # Main uploads the thumbnail to GCS and returns its URL.
+        
+        return job_id, thumbnail_path if os.path.exists(thumbnail_path) else None
+
+    def split_job(self, job_id: str, file_path: str) -> list:
+        """
+        Splits the video into 5-minute chunks and registers segments in DB.
+        Returns the ordered list of segment paths.
+        """
         segment_pattern = os.path.join(self.temp_dir, f"{job_id}_%03d.mp4")
         
         # FFmpeg command to split
@@ -41,34 +62,126 @@ class JobManager:
         print(f"✂️ Splitting video for job {job_id}...")
         subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         
-        # 2.5 Generate Thumbnail
-        thumbnail_path = os.path.join(self.upload_dir, f"{job_id}_thumb.jpg")
-        thumb_cmd = ["ffmpeg", "-i", file_path, "-ss", "00:00:01", "-vframes", "1", "-y", thumbnail_path]
-        subprocess.run(thumb_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        
-        # We need to upload this to GCS to get a URL, or serve it statically.
-        # For MVP V2, assuming GCS service is available here or we just store path.
-        # Ideally, we call gcs_service.upload_file... let's check imports.
-        # Import inside method to avoid circular dep if needed, or assume main handles it.
-        # Check: Main.py handles upload? No, create_job is called in main. 
-        # Hack: We will return thumbnail_path and let Main upload it.
-
-        
-        # 3. Discover segments
+        # Discover segments
         # Pattern matching to find created files
         # Note: glob pattern needs wildcard
         search_pattern = os.path.join(self.temp_dir, f"{job_id}_*.mp4")
         segments = sorted(glob.glob(search_pattern))
         
-        # 4. Register Segments in DB
+        # Register Segments in DB
         for idx, seg_path in enumerate(segments):
             db_service.create_segment(job_id, idx, status="pending")
             print(f"  -> Segment {idx} registered: {os.path.basename(seg_path)}")
             
-            print(f"  -> Segment {idx} registered: {os.path.basename(seg_path)}")
-            
-        return job_id, segments, thumbnail_path if os.path.exists(thumbnail_path) else None
+        return segments
+
+    # Stream parameters that must match across segments for a stream-copy concat
+    _CONCAT_VIDEO_KEYS = ("codec_name", "profile", "width", "height", "pix_fmt", "r_frame_rate", "time_base")
+    _CONCAT_AUDIO_KEYS = ("codec_name", "sample_rate", "channels")
+
+    def _probe_segment(self, path: str) -> dict:
+        """Stream parameters and duration of a segment (ffprobe, headers only)."""
+        cmd = [
+            "ffprobe", "-v", "error", "-show_entries",
+            "stream=codec_type,codec_name,profile,width,height,pix_fmt,r_frame_rate,time_base,sample_rate,channels"
+            ":format=duration",
+            "-of", "json", path
+        ]
+        info = json.loads(subprocess.run(cmd, check=True, capture_output=True, text=True).stdout or "{}")
+        streams = info.get("streams", [])
+        video = next((st for st in streams if st.get("codec_type") == "video"), {})
+        audio = next((st for st in streams if st.get("codec_type") == "audio"), None)
+        return {
+            "video": tuple(video.get(k) for k in self._CONCAT_VIDEO_KEYS),
+            "audio": tuple(audio.get(k) for k in self._CONCAT_AUDIO_KEYS) if audio else None,
+            "width": video.get("width"),
+            "height": video.get("height"),
+            "fps": video.get("r_frame_rate") or "24",
+            "duration": float(info.get("format", {}).get("duration") or 0),
+        }
+
+    def concat_segments(self, segment_paths: list, output_path: str):
+        """
+        Joins dubbed segments into one MP4.
+        Dubbed segments share one encoding (see processing.stretch_video), so this is
+        normally a concat-demuxer stream copy. Only when the probes disagree (e.g. a
+        pass-through chunk kept the source codec) is everything re-encoded.
+        """
+        probes = [self._probe_segment(path) for path in segment_paths]
+        first = probes[0]
+        if all(p["video"] == first["video"] and p["audio"] == first["audio"] for p in probes):
+            self._concat_copy(segment_paths, output_path)
+        else:
+            print("⚠️ Segments differ in format. Re-encoding the concat.")
+            self._concat_reencode(segment_paths, probes, output_path)
+
+    def _concat_copy(self, segment_paths: list, output_path: str):
+        list_path = f"{output_path}.txt"
+        try:
+            with open(list_path, "w") as f:
+                for path in segment_paths:
+                    f.write(f"file '{os.path.abspath(path)}'\n")
+            cmd = [
+                "ffmpeg", "-f", "concat", "-safe", "0", "-i", list_path,
+                "-c", "copy", "-movflags", "+faststart", "-y", output_path
+            ]
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        finally:
+            if os.path.exists(list_path):
+                os.remove(list_path)
+
+    def _concat_reencode(self, segment_paths: list, probes: list, output_path: str):
+        """Concat filter over inputs normalized to the first segment's size and frame rate."""
+        # libx264/yuv420p need even dimensions
+        width = (probes[0]["width"] or 1280) // 2 * 2
+        height = (probes[0]["height"] or 720) // 2 * 2
+        fps = probes[0]["fps"]
+
+        inputs, filters, pairs = [], [], []
+        for path in segment_paths:
+            inputs += ["-i", path]
+        silent_idx = len(segment_paths)
+        for i, probe in enumerate(probes):
+            filters.append(
+                f"[{i}:v]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps},format=yuv420p[v{i}]"
+            )
+            audio_src = f"{i}:a"
+            if probe["audio"] is None:
+                # Silent stand-in so the concat filter gets an audio stream for every segment
+                inputs += ["-f", "lavfi", "-t", f"{probe['duration']:.3f}", "-i", "anullsrc=r=44100:cl=stereo"]
+                audio_src = f"{silent_idx}:a"
+                silent_idx += 1
+            filters.append(f"[{audio_src}]aresample=44100,aformat=sample_rates=44100:channel_layouts=stereo[a{i}]")
+            pairs.append(f"[v{i}][a{i}]")
+        filters.append(f"{''.join(pairs)}concat=n={len(segment_paths)}:v=1:a=1[v][a]")
+
+        cmd = [
+            "ffmpeg", *inputs, "-filter_complex", ";".join(filters),
+            "-map", "[v]", "-map", "[a]",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+            "-c:a", "aac", "-b:a", "128k",
+            "-movflags", "+faststart", "-y", output_path
+        ]
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def cancel(self, job_id: str) -> bool:
+        """Asks the worker to stop after the current segment. False if the job isn't running."""
+        with self._lock:
+            if job_id not in self._active:
+                return False
+            self._cancelled.add(job_id)
+            return True
+
+    def is_cancelled(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._cancelled
 
+    def finish(self, job_id: str):
+        """Called by the worker when a job ends (done, failed or cancelled)."""
+        with self._lock:
+            self._active.discard(job_id)
+            self._cancelled.discard(job_id)
 
     def cleanup_source(self, file_path: str):
         """Deletes the original source file."""
@@ -1,7 +1,28 @@
 import os
+import json
+import base64
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from google.cloud import storage
 from google.oauth2 import service_account
+from google.api_core import exceptions as gcs_exceptions
+
+# Marker object written after CORS is applied to the bucket
+CORS_SENTINEL_BLOB = ".cors_done"
+
+# Cached STT results are content-addressed under this prefix and expire after 30 days
+STT_CACHE_PREFIX = "stt-cache/"
+STT_CACHE_TTL_DAYS = 30
+LIFECYCLE_SENTINEL_BLOB = ".lifecycle_done"
+
+# Resumable upload chunk size (must be a multiple of 256 KB)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Streaming downloads: ranged GETs of this size, this many in flight
+STREAM_RANGE_SIZE = 16 * 1024 * 1024
+STREAM_PARALLELISM = 4
 
 class GCSStorage:
     def __init__(self):
@@ -16,7 +37,6 @@ class GCSStorage:
         # 1. Priority: JSON String in Env Var (Koyeb/Render)
         if self.credentials_json_str:
             try:
-                import json
                 print("🔑 Found GCS_CREDENTIALS_JSON env var. Authenticating...")
                 info = json.loads(self.credentials_json_str)
                 creds = service_account.Credentials.from_service_account_info(info)
@@ -37,15 +57,20 @@ class GCSStorage:
             except Exception as e:
                 print(f"❌ GCS Client Init Failed: {e}")
                 self.client = None
-        
-        # Auto-configure CORS for the bucket to allow browser playback
-        if self.client:
-            self.configure_cors()
 
-    def configure_cors(self):
-        """Sets CORS policy on the bucket to allow playback from any origin."""
+    def configure_cors(self, force: bool = False):
+        """
+        Sets CORS policy on the bucket to allow playback from any origin.
+        Runs once per bucket: a sentinel blob records that it was applied, so
+        cold starts skip the bucket.patch() round trip unless force=True.
+        """
+        if not self.client: return
         try:
             bucket = self.client.bucket(self.bucket_name)
+            sentinel = bucket.blob(CORS_SENTINEL_BLOB)
+            if not force and sentinel.exists():
+                print(f"✅ GCS Bucket CORS already configured for {self.bucket_name}")
+                return
             bucket.cors = [
                 {
                     "origin": ["*"],
@@ -60,10 +85,74 @@ class GCSStorage:
                 }
             ]
             bucket.patch()
+            sentinel.upload_from_string("ok", content_type="text/plain")
             print(f"✅ GCS Bucket CORS Configured for {self.bucket_name}")
         except Exception as e:
             print(f"⚠️ GCS CORS Config Failed: {e}")
 
+    def configure_lifecycle(self, force: bool = False):
+        """Adds the STT cache expiry rule to the bucket (once, tracked like configure_cors)."""
+        if not self.client: return
+        try:
+            bucket = self.client.bucket(self.bucket_name)
+            sentinel = bucket.blob(LIFECYCLE_SENTINEL_BLOB)
+            if not force and sentinel.exists():
+                return
+            bucket.reload()
+            rules = [r for r in bucket.lifecycle_rules if STT_CACHE_PREFIX not in r.get("condition", {}).get("matchesPrefix", [])]
+            bucket.lifecycle_rules = rules
+            bucket.add_lifecycle_delete_rule(age=STT_CACHE_TTL_DAYS, matches_prefix=[STT_CACHE_PREFIX])
+            bucket.patch()
+            sentinel.upload_from_string("ok", content_type="text/plain")
+            print(f"✅ GCS Lifecycle: {STT_CACHE_PREFIX}* expires after {STT_CACHE_TTL_DAYS} days")
+        except Exception as e:
+            print(f"⚠️ GCS Lifecycle Config Failed: {e}")
+
+    def upload_json(self, data, destination_blob_name: str) -> bool:
+        """Writes a small JSON document to the bucket."""
+        if not self.client: return False
+        try:
+            blob = self.client.bucket(self.bucket_name).blob(destination_blob_name)
+            blob.upload_from_string(json.dumps(data, ensure_ascii=False), content_type="application/json")
+            return True
+        except Exception as e:
+            print(f"⚠️ GCS JSON Upload Error: {e}")
+            return False
+
+    def download_json(self, blob_name: str):
+        """Reads a JSON document from the bucket. Returns None if missing."""
+        if not self.client: return None
+        try:
+            blob = self.client.bucket(self.bucket_name).blob(blob_name)
+            return json.loads(blob.download_as_bytes())
+        except gcs_exceptions.NotFound:
+            return None
+        except Exception as e:
+            print(f"⚠️ GCS JSON Download Error: {e}")
+            return None
+
+    def blob_exists(self, blob_name: str) -> bool:
+        if not self.client: return False
+        try:
+            return self.client.bucket(self.bucket_name).blob(blob_name).exists()
+        except Exception as e:
+            print(f"⚠️ GCS Exists Check Error: {e}")
+            return False
+
+    def download_file(self, blob_name: str, destination_path: str) -> bool:
+        """Downloads a blob to a local file (parallel ranged GETs). Returns False if missing or on error."""
+        if not self.client: return False
+        try:
+            with open(destination_path, "wb") as f:
+                for chunk in self._ranged_chunks(blob_name):
+                    f.write(chunk)
+            return True
+        except Exception as e:
+            print(f"⚠️ GCS Download Error ({blob_name}): {e}")
+            if os.path.exists(destination_path):
+                os.remove(destination_path)
+            return False
+
     def upload_file(self, source_path: str, destination_blob_name: str, content_type: str = "video/mp4") -> str:
         """Uploads a file to the bucket and returns the public/signed URL."""
         if not self.client: return None
@@ -72,7 +161,21 @@ class GCSStorage:
             bucket = self.client.bucket(self.bucket_name)
             blob = bucket.blob(destination_blob_name)
             
-            blob.upload_from_filename(source_path, content_type=content_type)
+            # Skip the transfer if an identical object is already there (retries/re-runs)
+            local_md5 = self._file_md5(source_path)
+            try:
+                blob.reload()
+                if blob.md5_hash == local_md5:
+                    print(f"⏭️ GCS Upload Skipped (unchanged): {destination_blob_name}")
+                    return self.generate_signed_url(destination_blob_name)
+            except gcs_exceptions.NotFound:
+                pass
+            except gcs_exceptions.GoogleAPIError as e:
+                # Precheck is only an optimisation (e.g. 403 without objects.get): upload anyway
+                print(f"⚠️ GCS Precheck Skipped: {e}")
+            
+            blob.chunk_size = UPLOAD_CHUNK_SIZE # Resumable, chunked transfer
+            blob.upload_from_filename(source_path, content_type=content_type, checksum="md5")
             
             print(f"✅ GCS Upload Success: {destination_blob_name}")
             return self.generate_signed_url(destination_blob_name)
@@ -81,6 +184,15 @@ class GCSStorage:
             print(f"❌ GCS Upload Error: {e}")
             return None
 
+    @staticmethod
+    def _file_md5(path: str) -> str:
+        """Base64 MD5 of a file (GCS md5_hash format), read in 1MB chunks."""
+        md5 = hashlib.md5()
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                md5.update(chunk)
+        return base64.b64encode(md5.digest()).decode()
+
     def generate_signed_url(self, blob_name: str, expiration_hours: int = 24) -> str:
         """Generates a V4 signed URL for the blob."""
         if not self.client: return ""
@@ -99,16 +211,41 @@ class GCSStorage:
             print(f"⚠️ URL Sign Error: {e}")
             return ""
 
+    def _ranged_chunks(self, blob_name: str):
+        """
+        Yields the blob's content in order, raising on error.
+        Fetches STREAM_RANGE_SIZE ranges over STREAM_PARALLELISM concurrent
+        connections (bounded window, so memory stays at ~parallelism x range).
+        """
+        pool = ThreadPoolExecutor(max_workers=STREAM_PARALLELISM)
+        try:
+            bucket = self.client.bucket(self.bucket_name)
+            blob = bucket.get_blob(blob_name)
+            if blob is None:
+                raise gcs_exceptions.NotFound(blob_name)
+
+            # Pin the generation so every range comes from the same object version
+            fetch = lambda start: pool.submit(
+                blob.download_as_bytes,
+                start=start, end=min(start + STREAM_RANGE_SIZE, blob.size) - 1,
+                if_generation_match=blob.generation
+            )
+            starts = iter(range(0, blob.size, STREAM_RANGE_SIZE))
+            window = deque(fetch(start) for _, start in zip(range(STREAM_PARALLELISM), starts))
+            while window:
+                chunk = window.popleft().result()
+                next_start = next(starts, None)
+                if next_start is not None:
+                    window.append(fetch(next_start))
+                yield chunk
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
     def stream_file_content(self, blob_name: str):
-        """Yields file content in chunks for streaming."""
+        """Yields file content in order for streaming (see _ranged_chunks)."""
         if not self.client: return None
         try:
-            bucket = self.client.bucket(self.bucket_name)
-            blob = bucket.blob(blob_name)
-            # Open directly as a stream
-            with blob.open("rb") as f:
-                while chunk := f.read(1024 * 1024): # 1MB chunks
-                    yield chunk
+            yield from self._ranged_chunks(blob_name)
         except Exception as e:
             print(f"❌ GCS Stream Error: {e}")
             yield b""
@@ -15,13 +15,15 @@ import { MarketingSections } from './components/MarketingSections';
 import { MyVideosPage } from './components/MyVideosPage';
 import { SettingsPage } from './components/SettingsPage';
 import { MainInterface } from './components/MainInterface';
-import { startRealProcessing, checkBackendHealth, BACKEND_URL, uploadVideo, getTaskStatus } from './services/apiService';
+import { startRealProcessing, checkBackendHealth, BACKEND_URL, uploadVideo, watchJob, summarizeJob, getJobDetails, cancelJob, JobCounts } from './services/apiService';
 import { generateVideoInsights } from './services/geminiService';
 import { useAuth } from './contexts/AuthContext';
 import { useToast } from './components/ToastContext';
 import { ProcessingState, ProcessingStage, VideoMetadata, TaskStatus, Language, Theme, AppView, ServiceMode, HistoryItem } from './types';
 import { MOCK_YOUTUBE_THUMBNAIL, TRANSLATIONS, getStepsForMode } from './constants';
 
+const noop = () => { };
+
 function App() {
   // --- State Management ---
   const [url, setUrl] = useState('');
@@ -35,6 +37,7 @@ function App() {
   });
   const [metadata, setMetadata] = useState<VideoMetadata | null>(null);
   const [errorMsg, setErrorMsg] = useState('');
+  const [uploadProgress, setUploadProgress] = useState<{ percent: number; mbps: number } | null>(null);
 
   // Settings & Auth
   const [lang, setLang] = useState<Language>('ar');
@@ -241,8 +244,22 @@ function App() {
     setState(ProcessingState.PROCESSING);
 
     try {
-      // 2. Upload
-      const uploadResult = await uploadVideo(file, modeToUse, lang);
+      // 2. Upload (with progress + throughput; Cancel aborts the transfer)
+      const uploadAbort = new AbortController();
+      setStopProcessing(() => () => uploadAbort.abort());
+      const uploadStart = Date.now();
+      setUploadProgress({ percent: 0, mbps: 0 });
+      const uploadResult = await uploadVideo(file, modeToUse, lang, 'female', true, {
+        signal: uploadAbort.signal,
+        onProgress: (loaded, total) => {
+          const percent = Math.round((loaded / total) * 100);
+          const mbps = loaded / (1024 * 1024) / Math.max(0.001, (Date.now() - uploadStart) / 1000);
+          // Only re-render when the visible percentage moves
+          setUploadProgress(prev => prev && prev.percent === percent ? prev : { percent, mbps });
+        },
+      });
+      setUploadProgress(null);
+      if (uploadAbort.signal.aborted) return;
 
       console.log("Upload Response:", uploadResult); // Debugging
 
@@ -266,49 +283,54 @@ function App() {
         });
       }
 
-      // Start Polling
-      const poll = setInterval(async () => {
-        if (!taskId || taskId === 'undefined') {
-          clearInterval(poll);
-          return;
-        }
-
-        try {
-          const { status, completed, failed, result } = await getTaskStatus(taskId);
-          setTaskStatus(status);
+      // Subscribe to job updates (SSE, long-poll fallback). Counts only while
+      // processing; the player below fetches the segment list itself.
+      if (!taskId || taskId === 'undefined') return;
+
+      const unsubscribe = watchJob<JobCounts>(taskId, async (counts) => {
+        const { status, completed, failed } = summarizeJob(taskId, counts);
+        // Same progress as last update -> keep the old object so nothing re-renders
+        setTaskStatus(prev => (
+          prev.taskId === status.taskId && prev.progress === status.progress &&
+          prev.stage === status.stage && prev.message === status.message
+        ) ? prev : status);
+
+        if (completed) {
+          unsubscribe();
+          // Full segment list once, for the result URL
+          const details = await getJobDetails(taskId);
+          const { result } = summarizeJob(taskId, counts, details?.segments?.[0]?.media_url);
+          // UPDATE URL WITH DUBBED VIDEO
+          setMetadata(prev => prev ? {
+            ...prev,
+            title: result?.title || prev.title,
+            thumbnail: result?.thumbnail || prev.thumbnail,
+            url: result?.dubbed_video_url || prev.url,
+          } : null);
+          console.log('📹 Result URL:', result?.dubbed_video_url);
+          setState(ProcessingState.COMPLETED);
+          showSuccess(lang === 'ar' ? 'تمت الدبلجة بنجاح! 🎉' : 'Dubbing completed! 🎉');
+          setUploadedFile(null);
 
-          if (completed) {
-            clearInterval(poll);
-            // UPDATE URL WITH DUBBED VIDEO
-            setMetadata(prev => prev ? {
-              ...prev,
-              title: result?.title || prev.title,
-              thumbnail: result?.thumbnail || prev.thumbnail,
-              url: result?.dubbed_video_url || prev.url,
-            } : null);
-            console.log('📹 Result URL:', result?.dubbed_video_url);
-            setState(ProcessingState.COMPLETED);
-            showSuccess(lang === 'ar' ? 'تمت الدبلجة بنجاح! 🎉' : 'Dubbing completed! 🎉');
-            setUploadedFile(null);
-
-            // UX Fix: Notify if split
-            if (result && result.segments_count && result.segments_count > 1) {
-              showInfo(lang === 'ar' ? `ملاحظة: تم تقسيم الفيديو إلى ${result.segments_count} أجزاء لضمان الجودة` : `Note: Video split into ${result.segments_count} parts for quality.`);
-            }
-
-          } else if (failed) {
-
-            clearInterval(poll);
-            setErrorMsg(status.message || 'فشلت المعالجة');
-            setState(ProcessingState.FAILED);
-            showError(status.message || 'فشلت المعالجة');
+          // UX Fix: Notify if split
+          if (result && result.segments_count && result.segments_count > 1) {
+            showInfo(lang === 'ar' ? `ملاحظة: تم تقسيم الفيديو إلى ${result.segments_count} أجزاء لضمان الجودة` : `Note: Video split into ${result.segments_count} parts for quality.`);
           }
-        } catch (err) {
-          console.error('Polling error:', err);
+
+        } else if (failed) {
+
+          unsubscribe();
+          setErrorMsg(status.message || 'فشلت المعالجة');
+          setState(ProcessingState.FAILED);
+          showError(status.message || 'فشلت المعالجة');
         }
-      }, 5000);
+      }, (msg) => {
+        setErrorMsg(msg);
+        setState(ProcessingState.FAILED);
+        showError(msg);
+      }, 'summary');
 
-      setStopProcessing(() => () => clearInterval(poll));
+      setStopProcessing(() => unsubscribe);
 
     } catch (err: any) {
       setErrorMsg(err.message || 'حدث خطأ غير متوقع');
@@ -331,12 +353,16 @@ function App() {
       stopProcessing();
       setStopProcessing(null);
     }
+    // Cancelling mid-job: stop the server-side worker too, not just our watcher
+    if (state === ProcessingState.PROCESSING && taskStatus.taskId) {
+      cancelJob(taskStatus.taskId);
+    }
     setUrl('');
     setState(ProcessingState.IDLE);
     setMetadata(null);
     setTaskStatus({ taskId: '', progress: 0, stage: ProcessingStage.DOWNLOAD, message: '' });
     setErrorMsg('');
-  }, [stopProcessing]);
+  }, [stopProcessing, state, taskStatus.taskId]);
 
   const handleLoginSuccess = () => {
     showSuccess(lang === 'ar' ? 'تم تسجيل الدخول بنجاح!' : 'Login successful!');
@@ -468,6 +494,17 @@ function App() {
                 </div>
 
                 <div className="bg-white dark:bg-slate-900/50 rounded-2xl p-8 border border-slate-200 dark:border-slate-800 shadow-xl">
+                  {uploadProgress && (
+                    <div className="mb-6">
+                      <div className="flex justify-between text-sm text-slate-600 dark:text-slate-400 mb-2">
+                        <span>{lang === 'ar' ? 'جاري رفع الفيديو...' : 'Uploading video...'}</span>
+                        <span dir="ltr">{uploadProgress.percent}% · {uploadProgress.mbps.toFixed(1)} MB/s</span>
+                      </div>
+                      <div className="h-2 rounded-full bg-slate-200 dark:bg-slate-700 overflow-hidden">
+                        <div className="h-full bg-indigo-600 transition-all" style={{ width: `${uploadProgress.percent}%` }} />
+                      </div>
+                    </div>
+                  )}
                   <StageStepper currentStage={taskStatus.stage} mode={mode} t={t} />
 
                   {/* NEW: Smart Playlist Player (Progressive Playback) */}
@@ -475,10 +512,9 @@ function App() {
                     <SmartVideoPlayer
                       jobId={taskStatus.taskId}
                       poster={metadata?.thumbnail || MOCK_YOUTUBE_THUMBNAIL}
-                      onAllFinished={() => {
-                        // Optional: Auto-transition logic could go here, 
-                        // but App.tsx main polling handles the state transition to COMPLETED
-                      }}
+                      // Stable callback keeps the memoized player out of status re-renders.
+                      // App.tsx's job watcher handles the state transition to COMPLETED.
+                      onAllFinished={noop}
                     />
                   </div>
                 </div>
@@ -508,7 +544,7 @@ function App() {
                 <SmartVideoPlayer
                   jobId={taskStatus.taskId || metadata?.url?.split('jobs/')[1]?.split('/')[0] || ''}
                   poster={metadata?.thumbnail || MOCK_YOUTUBE_THUMBNAIL}
-                  onAllFinished={() => { }}
+                  onAllFinished={noop}
                 />
 
                 <div className="text-center mt-8">
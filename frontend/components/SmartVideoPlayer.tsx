@@ -3,7 +3,7 @@ import {
     Play, Pause, Loader2, RefreshCw, Volume2, VolumeX,
     Maximize, SkipForward, List, CheckCircle, AlertCircle, Clock, Lock, Captions, Upload
 } from 'lucide-react';
-import { getJobDetails, VideoSegment } from '../services/apiService';
+import { watchJob, finalVideoUrl, prepareFinalVideo, VideoSegment } from '../services/apiService';
 
 interface SmartVideoPlayerProps {
     jobId: string;
@@ -11,8 +11,14 @@ interface SmartVideoPlayerProps {
     onAllFinished?: () => void;
 }
 
+const sameSegments = (a: VideoSegment[], b: VideoSegment[]) =>
+    a.length === b.length && a.every((s, i) =>
+        s.segment_index === b[i].segment_index && s.status === b[i].status && s.media_url === b[i].media_url
+    );
 
-export const SmartVideoPlayer: React.FC<SmartVideoPlayerProps> = ({ jobId, poster, onAllFinished }) => {
+// Memoized: the parent re-renders on every job status update, but the player only
+// needs to when its own props change (it watches the job's segments itself).
+export const SmartVideoPlayer = React.memo<SmartVideoPlayerProps>(({ jobId, poster, onAllFinished }) => {
     // --- State ---
     const [segments, setSegments] = useState<VideoSegment[]>([]);
     const [currentIndex, setCurrentIndex] = useState(0);
@@ -23,42 +29,33 @@ export const SmartVideoPlayer: React.FC<SmartVideoPlayerProps> = ({ jobId, poste
     const [duration, setDuration] = useState(0); // Real duration from metadata
     const [autoAdvance, setAutoAdvance] = useState(true);
     const [nextOverlayVisible, setNextOverlayVisible] = useState(false);
+    const [finalState, setFinalState] = useState<'idle' | 'building' | 'failed'>('idle');
 
     // Refs
     const videoRef = useRef<HTMLVideoElement>(null);
     const containerRef = useRef<HTMLDivElement>(null);
-    const pollInterval = useRef<ReturnType<typeof setTimeout> | null>(null);
+    const finalAbortRef = useRef<AbortController | null>(null);
 
-    // --- Data Fetching ---
-    const fetchSegments = async () => {
+    // --- Data Fetching (SSE push, long-poll fallback) ---
+    useEffect(() => {
         if (!jobId || jobId === 'undefined') return; // Guard against undefined string
-        try {
-            const data = await getJobDetails(jobId);
+        return watchJob(jobId, (data) => {
             if (data && data.segments) {
-                const sorted = data.segments.sort((a, b) => a.segment_index - b.segment_index);
-                setSegments(prev => {
-                    // Force update if needed, but for now simple set is okay
-                    return sorted;
-                });
+                const sorted = [...data.segments].sort((a, b) => a.segment_index - b.segment_index);
+                // Keep the previous array when nothing the player renders changed (no re-render)
+                setSegments(prev => sameSegments(prev, sorted) ? prev : sorted);
             }
-        } catch (err) {
-            console.error("Failed to fetch segments", err);
-        }
-    };
-
-    useEffect(() => {
-        if (!jobId || jobId === 'undefined') return;
-        fetchSegments();
-        pollInterval.current = setInterval(fetchSegments, 3000);
-        return () => {
-            if (pollInterval.current) clearInterval(pollInterval.current);
-        };
+        });
     }, [jobId]);
 
+    // Stop waiting for a full-video build when the job changes or the player unmounts
+    useEffect(() => () => finalAbortRef.current?.abort(), [jobId]);
+
     // --- Logic ---
     const currentSegment = segments.find(s => s.segment_index === currentIndex);
     const nextSegment = segments.find(s => s.segment_index === currentIndex + 1);
 
+    const allReady = segments.length > 0 && segments.every(s => s.status === 'ready');
     const isReady = currentSegment?.status === 'ready';
     const isProcessing = currentSegment?.status === 'processing' || currentSegment?.status === 'pending';
     const isFailed = currentSegment?.status === 'failed';
@@ -155,6 +152,26 @@ export const SmartVideoPlayer: React.FC<SmartVideoPlayerProps> = ({ jobId, poste
         else containerRef.current.requestFullscreen();
     };
 
+    // Full video is stitched on demand: wait for the server build, then download it
+    const downloadFullVideo = async () => {
+        if (finalState === 'building') return;
+        finalAbortRef.current?.abort();
+        const controller = new AbortController();
+        finalAbortRef.current = controller;
+        setFinalState('building');
+        const ready = await prepareFinalVideo(jobId, controller.signal);
+        if (controller.signal.aborted) return;
+        setFinalState(ready ? 'idle' : 'failed');
+        if (ready) {
+            const link = document.createElement('a');
+            link.href = finalVideoUrl(jobId);
+            link.download = '';
+            link.target = '_blank';
+            link.rel = 'noopener noreferrer';
+            link.click();
+        }
+    };
+
     const selectSegment = (index: number) => {
         const seg = segments.find(s => s.segment_index === index);
         if (seg?.status === 'ready') {
@@ -178,6 +195,21 @@ export const SmartVideoPlayer: React.FC<SmartVideoPlayerProps> = ({ jobId, poste
                             {segments.length} مقاطع
                         </span>
                     </div>
+                    {/* Full video: one file stitched on the server instead of N downloads */}
+                    {allReady && segments.length > 1 && (
+                        <button
+                            onClick={downloadFullVideo}
+                            disabled={finalState === 'building'}
+                            className="mt-2 inline-flex items-center gap-1 text-xs font-bold text-indigo-600 hover:text-indigo-800 disabled:opacity-60 disabled:cursor-wait"
+                        >
+                            {finalState === 'building'
+                                ? <Loader2 className="w-4 h-4 animate-spin" />
+                                : <Upload className="w-4 h-4 rotate-180" />}
+                            {finalState === 'building' ? 'جاري تجهيز الفيديو كاملاً...'
+                                : finalState === 'failed' ? 'تعذر التجهيز، حاول مجدداً'
+                                : 'تحميل الفيديو كاملاً'}
+                        </button>
+                    )}
                 </div>
 
                 <div className="flex-1 overflow-y-auto p-4 space-y-3 custom-scrollbar">
@@ -350,5 +382,5 @@ export const SmartVideoPlayer: React.FC<SmartVideoPlayerProps> = ({ jobId, poste
             </div>
         </div>
     );
-};
+});
 
@@ -1,4 +1,4 @@
-import axios from 'axios';
+import axios, { AxiosError } from 'axios';
 import { ProcessingStage, TaskStatus, ServiceMode } from '../types';
 
 // ===========================================================================
@@ -15,6 +15,40 @@ console.log(`🔌 [API Service] Initialized (Force Build 🚀).`);
 console.log(`🎯 [API Service] Connected to: ${API_BASE_URL}`);
 // ===========================================================================
 
+const sleep = (ms: number) => new Promise(resolve => setTimeout(resolve, ms));
+
+// --- Shared HTTP client ---
+// One axios instance for every backend call (the browser keeps its connections alive).
+// Idempotent GETs that hit a gateway error (502/503/504 from the edge) are retried
+// here with 1s/2s/4s backoff, so callers only see errors that outlast a short blip.
+const GATEWAY_RETRY_STATUSES = [502, 503, 504];
+const GATEWAY_RETRY_MAX = 3;
+
+const api = axios.create({ baseURL: API_BASE_URL });
+
+// Every endpoint answers JSON. A 200 with anything else (e.g. an HTML maintenance
+// page from the edge) is rejected up front instead of being read as an empty job.
+// No `response` is attached, so the retry logic treats it like a network error.
+api.interceptors.response.use((response) => {
+  const contentType = String(response.headers['content-type'] || '');
+  if (!contentType.includes('application/json')) {
+    throw new AxiosError(
+      `Unexpected ${contentType || 'non-JSON'} response from ${response.config.url}`,
+      AxiosError.ERR_BAD_RESPONSE, response.config, response.request
+    );
+  }
+  return response;
+}, async (error) => {
+  const config = error.config;
+  if (!config || config.method !== 'get' || !GATEWAY_RETRY_STATUSES.includes(error.response?.status)) {
+    throw error;
+  }
+  config.retryCount = (config.retryCount || 0) + 1;
+  if (config.retryCount > GATEWAY_RETRY_MAX) throw error;
+  await sleep(1000 * 2 ** (config.retryCount - 1));
+  return api(config);
+});
+
 // --- Interfaces ---
 export interface TaskResponse {
   task_id: string;
@@ -42,6 +76,14 @@ export interface JobDetails {
   segments: VideoSegment[];
 }
 
+// Segment counts only (/job/{id}/summary, or view=summary on stream/wait)
+export interface JobCounts {
+  job_id?: string;
+  ready: number;
+  failed: number;
+  total: number;
+}
+
 // --- Helper: Map backend status to ProcessingStage ---
 function mapStatusToStage(status: string): ProcessingStage {
   const map: Record<string, ProcessingStage> = {
@@ -69,7 +111,8 @@ export const uploadVideo = async (
   mode: ServiceMode,
   targetLanguage: string = 'ar',
   voice: string = 'female',
-  generateSrt: boolean = true
+  generateSrt: boolean = true,
+  options: { onProgress?: (loaded: number, total: number) => void; signal?: AbortSignal } = {}
 ): Promise<{ taskId: string; task_id?: string; thumbnail_url?: string; success: boolean; error?: string }> => {
   const formData = new FormData();
   formData.append('file', file);
@@ -83,9 +126,13 @@ export const uploadVideo = async (
 
   try {
     // USE NEW /upload ENDPOINT (Async)
-    const response = await axios.post(`${API_BASE_URL}/upload`, formData, {
+    const response = await api.post('/upload', formData, {
       headers: { 'Content-Type': 'multipart/form-data' },
       timeout: 120000, // 2 mins to be safe
+      signal: options.signal,
+      onUploadProgress: (event) => {
+        if (options.onProgress && event.total) options.onProgress(event.loaded, event.total);
+      },
     });
 
     const data = response.data;
@@ -108,70 +155,113 @@ export const uploadVideo = async (
   }
 };
 
-/**
- * Get task status with completed/failed flags
- * Returns: { status, completed, failed, result }
- */
-export const getTaskStatus = async (taskId: string): Promise<{
+export interface JobSummary {
   status: TaskStatus;
   completed: boolean;
   failed: boolean;
   result?: TaskResponse['result'];
-}> => {
-  try {
-    // Use NEW /job endpoint
-    const response = await axios.get<JobDetails>(`${API_BASE_URL}/job/${taskId}`);
-    const data = response.data;
-    const segments = data.segments || [];
+}
 
-    // Calculate aggregated status
-    const total = segments.length;
-    const readyCount = segments.filter(s => s.status === 'ready').length;
-    const failedCount = segments.filter(s => s.status === 'failed').length;
+/**
+ * Whole dubbed video as one MP4 (segments concatenated server-side)
+ */
+export const finalVideoUrl = (jobId: string) => `${API_BASE_URL}/job/${jobId}/final.mp4`;
 
-    let progress = 0;
-    if (total > 0) {
-      progress = Math.round((readyCount / total) * 100);
+const FINAL_POLL_MS = 5000;
+
+/**
+ * Ask the server to build the full video and wait until it exists.
+ * The build runs in the background (202 while in progress), so this polls.
+ * Resolves true when finalVideoUrl(jobId) is ready to download.
+ */
+export const prepareFinalVideo = async (jobId: string, signal?: AbortSignal): Promise<boolean> => {
+  while (!signal?.aborted) {
+    try {
+      const response = await api.post(`/job/${jobId}/final`, null, { signal });
+      if (response.status === 200) return true;
+    } catch (error) {
+      if (!signal?.aborted) console.error("Final Video Error:", error);
+      return false;
     }
+    await new Promise(resolve => setTimeout(resolve, FINAL_POLL_MS));
+  }
+  return false;
+};
+
+/**
+ * Count ready/failed segments in a single pass
+ */
+export const countSegments = (segments: VideoSegment[]): JobCounts => {
+  let ready = 0;
+  let failed = 0;
+  for (const s of segments) {
+    if (s.status === 'ready') ready++;
+    else if (s.status === 'failed') failed++;
+  }
+  return { ready, failed, total: segments.length };
+};
 
-    const isCompleted = total > 0 && readyCount === total;
-    const isFailed = failedCount > 0;
+/**
+ * Aggregate segment counts into the overall task status
+ * (firstUrl is only needed once the job is complete, to build the result)
+ */
+export const summarizeJob = (taskId: string, counts: JobCounts, firstUrl?: string): JobSummary => {
+  // Calculate aggregated status
+  const { total, ready: readyCount, failed: failedCount } = counts;
+
+  let progress = 0;
+  if (total > 0) {
+    progress = Math.round((readyCount / total) * 100);
+  }
+
+  const isCompleted = total > 0 && readyCount === total;
+  const isFailed = failedCount > 0;
 
-    // Determine overall status string for mapping stage
-    let statusStr = 'PROCESSING';
-    if (isCompleted) statusStr = 'COMPLETED';
-    else if (isFailed) statusStr = 'FAILED';
-    else if (total === 0) statusStr = 'PENDING';
+  // Determine overall status string for mapping stage
+  let statusStr = 'PROCESSING';
+  if (isCompleted) statusStr = 'COMPLETED';
+  else if (isFailed) statusStr = 'FAILED';
+  else if (total === 0) statusStr = 'PENDING';
 
-    const status: TaskStatus = {
-      taskId: taskId,
-      progress: progress,
-      stage: mapStatusToStage(statusStr),
-      message: isCompleted ? 'تمت الدبلجة بنجاح!' : `جاري المعالجة (${readyCount}/${total})...`
+  const status: TaskStatus = {
+    taskId: taskId,
+    progress: progress,
+    stage: mapStatusToStage(statusStr),
+    message: isCompleted ? 'تمت الدبلجة بنجاح!' : `جاري المعالجة (${readyCount}/${total})...`
+  };
+
+  // Synthesize result
+  let result = undefined;
+  if (isCompleted) {
+    result = {
+      dubbed_video_url: firstUrl?.startsWith('http') || firstUrl?.startsWith('/') ? firstUrl : `${API_BASE_URL}${firstUrl}`,
+      segments_count: total
     };
 
-    // Synthesize result
-    let result = undefined;
-    if (isCompleted && segments.length > 0) {
-      // Find first media url
-      const firstUrl = segments[0].media_url;
-      result = {
-        dubbed_video_url: firstUrl?.startsWith('http') || firstUrl?.startsWith('/') ? firstUrl : `${API_BASE_URL}${firstUrl}`,
-        segments_count: total
-      };
-
-      // Ensure absolute URL if it's relative
-      if (result.dubbed_video_url && result.dubbed_video_url.startsWith('/')) {
-        result.dubbed_video_url = `${API_BASE_URL}${result.dubbed_video_url}`;
-      }
+    // Ensure absolute URL if it's relative
+    if (result.dubbed_video_url && result.dubbed_video_url.startsWith('/')) {
+      result.dubbed_video_url = `${API_BASE_URL}${result.dubbed_video_url}`;
     }
+  }
 
-    return {
-      status,
-      completed: isCompleted,
-      failed: isFailed,
-      result: result
-    };
+  return {
+    status,
+    completed: isCompleted,
+    failed: isFailed,
+    result: result
+  };
+};
+
+/**
+ * Get task status with completed/failed flags
+ * Returns: { status, completed, failed, result }
+ */
+export const getTaskStatus = async (taskId: string): Promise<JobSummary> => {
+  try {
+    // Use NEW /job endpoint
+    const response = await api.get<JobDetails>(`/job/${taskId}`);
+    const segments = response.data.segments || [];
+    return summarizeJob(taskId, countSegments(segments), segments[0]?.media_url);
   } catch (error) {
     console.error("Status Check Error:", error);
     return {
@@ -183,6 +273,96 @@ export const getTaskStatus = async (taskId: string): Promise<{
   }
 };
 
+const isJobSettled = (data: JobDetails | JobCounts) => {
+  const counts = 'segments' in data ? countSegments(data.segments || []) : data;
+  return counts.total > 0 && counts.ready + counts.failed === counts.total;
+};
+
+// Retry policy for transient failures (network, timeouts, 5xx): exponential backoff + jitter
+const BACKOFF_MAX_ATTEMPTS = 6;
+const BACKOFF_BASE_MS = 1000;
+const BACKOFF_CAP_MS = 30000;
+
+const backoffDelay = (attempt: number) =>
+  Math.min(BACKOFF_CAP_MS, BACKOFF_BASE_MS * 2 ** attempt) * (1 + Math.random() * 0.5);
+
+// 4xx (bad/unknown job id) won't fix itself; only network errors, 408/429 and 5xx are retried
+const isRecoverable = (error: any) => {
+  const code = error?.response?.status;
+  return code === undefined || code >= 500 || code === 408 || code === 429;
+};
+
+/**
+ * Subscribe to job updates via Server-Sent Events (/job/{id}/stream).
+ * Falls back to long polling /job/{id}/wait if the stream can't be opened.
+ * view='summary' receives JobCounts instead of the full segment list.
+ * onError fires if the job can't be watched (unknown id, or retries exhausted).
+ * Returns: unsubscribe function
+ */
+export const watchJob = <T extends JobDetails | JobCounts = JobDetails>(
+  jobId: string,
+  onDetails: (details: T) => void,
+  onError?: (msg: string) => void,
+  view: 'full' | 'summary' = 'full'
+): (() => void) => {
+  let stopped = false;
+  let polling = false;
+  let source: EventSource | null = null;
+
+  const startLongPolling = async () => {
+    if (polling || stopped) return;
+    polling = true;
+    console.warn(`⚠️ [API Service] Job stream unavailable, falling back to long polling`);
+    let since = -1;
+    let attempt = 0;
+    while (!stopped) {
+      try {
+        // Server holds the request until the job's version moves past `since`
+        const response = await api.get<T & { version: number }>(`/job/${jobId}/wait`, {
+          params: { since, timeout: 25, view },
+          timeout: 30000,
+        });
+        since = response.data.version;
+        attempt = 0;
+        if (stopped) break;
+        onDetails(response.data);
+        if (isJobSettled(response.data)) break;
+      } catch (error: any) {
+        console.error("Long Poll Error:", error);
+        if (!isRecoverable(error) || attempt >= BACKOFF_MAX_ATTEMPTS) {
+          if (!stopped) onError?.(error.response?.data?.detail || 'خطأ في الاتصال');
+          break;
+        }
+        await sleep(backoffDelay(attempt++));
+      }
+    }
+  };
+
+  if (typeof EventSource === 'undefined') {
+    startLongPolling();
+  } else {
+    source = new EventSource(`${API_BASE_URL}/job/${jobId}/stream?view=${view}`);
+    source.onmessage = (event) => {
+      try {
+        onDetails(JSON.parse(event.data));
+      } catch (err) {
+        console.error("Job Stream Parse Error:", err);
+      }
+    };
+    // Server sends 'done' once every segment is ready/failed
+    source.addEventListener('done', () => source?.close());
+    source.onerror = () => {
+      // CONNECTING = browser is retrying on its own; CLOSED = endpoint refused the stream
+      if (source?.readyState === EventSource.CLOSED) startLongPolling();
+    };
+  }
+
+  return () => {
+    stopped = true;
+    source?.close();
+  };
+};
+
 // Alias for backward compatibility
 export const checkStatus = getTaskStatus;
 
@@ -191,12 +371,12 @@ export const checkStatus = getTaskStatus;
  */
 export const checkBackendHealth = async (): Promise<boolean> => {
   try {
-    const response = await axios.get(`${API_BASE_URL}/health`, { timeout: 5000 });
+    const response = await api.get('/health', { timeout: 5000 });
     return response.status === 200;
   } catch {
     // Try root endpoint as fallback
     try {
-      await axios.get(API_BASE_URL, { timeout: 5000 });
+      await api.get('/', { timeout: 5000 });
       return true;
     } catch {
       return false;
@@ -229,12 +409,25 @@ export const startRealProcessing = (
 // Export for backward compatibility
 export type { ServiceMode } from '../types';
 
+/**
+ * Ask the backend to stop a running job (frees the worker instead of dubbing segments nobody will watch)
+ */
+export const cancelJob = async (jobId: string): Promise<boolean> => {
+  try {
+    await api.post(`/job/${jobId}/cancel`);
+    return true;
+  } catch (error) {
+    console.error("Cancel Job Error:", error);
+    return false;
+  }
+};
+
 /**
  * Fetch job details and segments
  */
 export const getJobDetails = async (jobId: string): Promise<JobDetails | null> => {
   try {
-    const response = await axios.get<JobDetails>(`${API_BASE_URL}/job/${jobId}`);
+    const response = await api.get<JobDetails>(`/job/${jobId}`);
     return response.data;
   } catch (error) {
     console.error("Fetch Job Details Error:", error);